@@ -0,0 +1,128 @@
+"""
+Tests of the upload of local files against a fake Blob Storage endpoint.
+"""
+import asyncio
+import os
+import re
+from email.utils import formatdate
+
+from aiohttp import web
+from azure.storage.blob.aio import ContainerClient
+
+import upload_data
+
+CONTAINER_NAME = "data"
+
+
+def _fake_blob_service(blobs: dict) -> web.Application:
+    """
+    Create an application serving Put Blob, Put Block and Put Block List requests
+    and keeping uploaded blobs and their metadata in the dictionary.
+    """
+    staged_blocks = {}
+
+    async def put_blob(request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        body = await request.read()
+        comp = request.query.get("comp")
+        if comp == "block":
+            staged_blocks.setdefault(name, {})[request.query["blockid"]] = body
+        elif comp == "blocklist":
+            block_ids = re.findall(r"<Latest>([^<]*)</Latest>", body.decode())
+            content = b"".join(staged_blocks[name][block_id] for block_id in block_ids)
+            blobs[name] = (content, _metadata(request))
+        else:
+            blobs[name] = (body, _metadata(request))
+        return web.Response(status=201, headers={
+            "ETag": '"0x1"',
+            "Last-Modified": formatdate(usegmt=True),
+            "x-ms-request-server-encrypted": "true",
+        })
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_put(f"/{CONTAINER_NAME}/{{name}}", put_blob)
+    return app
+
+
+def _metadata(request: web.Request) -> dict:
+    return {
+        key[len("x-ms-meta-"):]: value
+        for key, value in request.headers.items()
+        if key.lower().startswith("x-ms-meta-")
+    }
+
+
+async def _upload(tmp_path, sizes: dict) -> tuple:
+    blobs = {}
+    runner = web.AppRunner(_fake_blob_service(blobs))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    files = {}
+    for file_name, size in sizes.items():
+        content = os.urandom(size)
+        (tmp_path / file_name).write_bytes(content)
+        files[file_name] = content
+
+    # with these settings the SDK would upload larger files through its chunked path,
+    # which can't read aiofiles streams, so the script must never hand such files to upload_blob
+    client_settings = {
+        "retry_total": 0,
+        "max_block_size": upload_data.MAX_BLOCK_SIZE,
+        "max_single_put_size": upload_data.MAX_SINGLE_PUT_SIZE,
+    }
+    try:
+        async with ContainerClient(
+            f"http://127.0.0.1:{port}", CONTAINER_NAME, **client_settings
+        ) as container_client:
+            semaphore = asyncio.Semaphore(upload_data.MAX_CONCURRENT_UPLOADS)
+            block_semaphore = asyncio.Semaphore(upload_data.MAX_BLOCKS_IN_FLIGHT)
+            await asyncio.gather(*[
+                upload_data._upload_file(
+                    container_client, semaphore, block_semaphore, str(tmp_path / file_name), file_name, None
+                )
+                for file_name in files
+            ])
+    finally:
+        await runner.cleanup()
+    return files, blobs
+
+
+def test_upload_file_single_put_and_blocks(tmp_path):
+    # a single put, a file between the single put and the default SDK limit (64 MiB),
+    # and a file with a partial last block
+    sizes = {
+        "small.pdf": 1024 * 1024,
+        "medium.pdf": 12 * 1024 * 1024,
+        "uneven.pdf": 2 * upload_data.MAX_BLOCK_SIZE + 123,
+    }
+    files, blobs = asyncio.run(_upload(tmp_path, sizes))
+
+    assert set(blobs) == set(files)
+    for file_name, content in files.items():
+        uploaded, metadata = blobs[file_name]
+        assert uploaded == content
+        assert metadata[upload_data.CONTENT_HASH_METADATA] == upload_data._content_hash(str(tmp_path / file_name))
+
+
+def test_upload_file_skips_unchanged(tmp_path):
+    file = tmp_path / "same.pdf"
+    file.write_bytes(b"%PDF-1.4")
+
+    # the container client is never used for an unchanged file
+    asyncio.run(upload_data._upload_file(
+        None,
+        asyncio.Semaphore(1),
+        asyncio.Semaphore(1),
+        str(file),
+        "same.pdf",
+        upload_data._content_hash(str(file)),
+    ))
+
+
+def test_is_pdf_ignores_case():
+    assert upload_data._is_pdf("folder/file.pdf")
+    assert upload_data._is_pdf("FILE.PDF")
+    assert not upload_data._is_pdf("file.pdf.txt")
@@ -4,77 +4,407 @@ Initialize blob storage with local data.
 We assume that this code will be executed just once to prepare a blob container for experiments.
 """
 import argparse
+import asyncio
+import hashlib
 import logging
+import math
+import mmap
 import os
-from pathlib import Path
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient
+import random
+from typing import Awaitable, Callable, Dict, Iterator, Optional
+import aiofiles
+import aiohttp
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ServiceRequestError, ServiceResponseError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.identity.aio import DefaultAzureCredential
+from azure.storage.blob import BlobBlock, BlobProperties
+from azure.storage.blob.aio import BlobClient, BlobServiceClient, ContainerClient, ExponentialRetry
+
+try:
+    # libuv based event loop, available on Linux and macOS only
+    import uvloop
+except ImportError:
+    uvloop = None
 
 
 logger = logging.getLogger(__name__)
 
-# Setting the threshold of logger to DEBUG
-logger.setLevel(logging.DEBUG)
+STORAGE_ACCOUNT_URL = "https://{storage_account_name}.blob.core.windows.net"
 
-# Create a console handler and set its level to DEBUG
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
+# Maximum number of files uploaded at the same time
+MAX_CONCURRENT_UPLOADS = 16
 
-# Create a formatter and set it for the console handler
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(formatter)
+# Block size and the largest file uploaded with a single request.
+# Larger files are staged block by block and committed with a block list.
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+MAX_SINGLE_PUT_SIZE = MAX_BLOCK_SIZE
 
-# Add the console handler to the logger
-logger.addHandler(console_handler)
+# Number of blocks staged at the same time across all files. Every single-put file and every
+# staged block is read into memory, so uploads hold at most
+# (MAX_CONCURRENT_UPLOADS + MAX_BLOCKS_IN_FLIGHT) * MAX_BLOCK_SIZE = 384 MiB of file data.
+MAX_BLOCKS_IN_FLIGHT = 32
 
-STORAGE_ACCOUNT_URL = "https://{storage_account_name}.blob.core.windows.net"
+# Size of the connection pool shared by all uploads, enough for every request in flight
+CONNECTION_POOL_SIZE = MAX_CONCURRENT_UPLOADS + MAX_BLOCKS_IN_FLIGHT
 
+# Blob metadata key to store the hash of the uploaded file
+CONTENT_HASH_METADATA = "contenthash"
 
-def upload_data_files(
-    credential: DefaultAzureCredential,
-    storage_account_name: str,
-    storage_container: str,
-    local_folder: str,
+# Size of the slices fed into the hash
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Retry policy of the SDK applied to every request: the n-th retry waits
+# RETRY_INITIAL_BACKOFF + RETRY_INCREMENT_BASE ** n seconds (plus jitter), about 35 s for all retries
+RETRY_TOTAL = 4
+RETRY_INITIAL_BACKOFF = 1
+RETRY_INCREMENT_BASE = 2
+
+# Attempts to upload a single file if the SDK gives up on a request. Each attempt includes
+# the SDK retries, so a file failing with a transient error is sent up to
+# MAX_FILE_ATTEMPTS * (RETRY_TOTAL + 1) = 15 times, sleeping about 110 s in total before failing.
+MAX_FILE_ATTEMPTS = 3
+
+# HTTP statuses worth retrying besides server errors (5xx): request timeout and throttling
+RETRYABLE_STATUS_CODES = (408, 429)
+
+
+def _is_transient(error: Exception) -> bool:
+    """
+    Check whether the error may go away if the request is repeated.
+
+    Args:
+        error: The error raised by the SDK.
+
+    Returns:
+        bool: True for connection errors, timeouts, throttling and server errors.
+    """
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+
+
+async def _with_retries(operation: Callable[[], Awaitable], file_name: str):
+    """
+    Run the operation, repeating it with exponential backoff and jitter on transient service errors.
+    Other errors, like authentication or missing resources, are raised right away.
+
+    Args:
+        operation: The function creating a new awaitable for each attempt.
+        file_name: The name of the blob to report in logs.
+    """
+    for attempt in range(MAX_FILE_ATTEMPTS):
+        try:
+            return await operation()
+        except (HttpResponseError, ServiceRequestError, ServiceResponseError) as e:
+            if not _is_transient(e) or attempt == MAX_FILE_ATTEMPTS - 1:
+                raise
+            delay = random.uniform(0, 2 ** attempt)
+            logger.warning("Attempt %d for %s failed: %s. Retrying in %.1f s.", attempt + 1, file_name, e, delay)
+            await asyncio.sleep(delay)
+
+
+def _is_pdf(name: str) -> bool:
+    """
+    Check whether the file or blob name has the pdf extension in any case.
+
+    Args:
+        name: The name of the file or blob.
+
+    Returns:
+        bool: True for pdf files.
+    """
+    return name.lower().endswith(".pdf")
+
+
+def _iter_pdfs(root: str) -> Iterator[str]:
+    """
+    Walk the folder recursively and yield paths of all pdf files, skipping folders that can't be read.
+
+    Args:
+        root: The folder to start from.
+
+    Returns:
+        Iterator[str]: Paths of the pdf files.
+    """
+    try:
+        entries = os.scandir(root)
+    except PermissionError as e:
+        logger.warning("Skipped folder %s: %s", root, e)
+        return
+
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_pdfs(entry.path)
+            elif entry.is_file() and _is_pdf(entry.name):
+                yield entry.path
+
+
+def _content_hash(file: str) -> str:
+    """
+    Calculate SHA-256 hash of the file mapping it into memory rather than reading it into a buffer.
+    OpenSSL computes SHA-256 with SHA-NI instructions where available, which is faster than MD5.
+
+    Args:
+        file: The path to the local file.
+
+    Returns:
+        str: The hex digest of the file.
+    """
+    content_hash = hashlib.sha256()
+    with open(file, mode="rb") as data:
+        # empty files can't be mapped
+        if os.fstat(data.fileno()).st_size == 0:
+            return content_hash.hexdigest()
+        with mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            for offset in range(0, len(view), HASH_CHUNK_SIZE):
+                content_hash.update(view[offset:offset + HASH_CHUNK_SIZE])
+    return content_hash.hexdigest()
+
+
+async def _upload_blocks(
+    blob_client: BlobClient,
+    file: str,
+    size: int,
+    metadata: Dict[str, str],
+    block_semaphore: asyncio.Semaphore,
 ):
+    """
+    Upload a large file by staging its blocks in parallel and committing the block list.
 
-    account_url = STORAGE_ACCOUNT_URL.format(storage_account_name=storage_account_name)
-    blob_service_client = BlobServiceClient(
-        account_url=account_url, credential=credential
+    Args:
+        blob_client: The client of the target blob.
+        file: The path to the local file.
+        size: The size of the file in bytes.
+        metadata: The metadata of the blob to set on commit.
+        block_semaphore: The semaphore limiting the number of blocks staged at the same time by all files.
+    """
+    async def _stage_block(block_id: str, offset: int):
+        async with block_semaphore:
+            async with aiofiles.open(file=file, mode="rb") as data:
+                await data.seek(offset)
+                chunk = await data.read(MAX_BLOCK_SIZE)
+            await blob_client.stage_block(block_id=block_id, data=chunk, length=len(chunk))
+
+    # block ids must have the same length, the SDK encodes them into base64
+    block_ids = [f"{index:08d}" for index in range(math.ceil(size / MAX_BLOCK_SIZE))]
+    await asyncio.gather(
+        *[_stage_block(block_id, index * MAX_BLOCK_SIZE) for index, block_id in enumerate(block_ids)]
+    )
+    await blob_client.commit_block_list(
+        [BlobBlock(block_id=block_id) for block_id in block_ids], metadata=metadata
     )
-    blob_container_client = blob_service_client.get_container_client(storage_container)
 
-    if not blob_container_client.exists():
-        logger.info(f"Creating {storage_container} container.")
-        blob_container_client.create_container()
-        logger.info("Done.")
 
-    for file in Path(local_folder).rglob("*.pdf"):
-        logger.info(f"Uploading {file} to {storage_container}.")
+async def _upload_file(
+    blob_container_client: ContainerClient,
+    semaphore: asyncio.Semaphore,
+    block_semaphore: asyncio.Semaphore,
+    file: str,
+    file_name: str,
+    remote_hash: Optional[str],
+):
+    """
+    Upload a single file into the container once a slot in the semaphore is available.
+    The file is skipped if the blob with the same content is already in the container.
+
+    Args:
+        blob_container_client: The client of the target container.
+        semaphore: The semaphore limiting the number of concurrent uploads.
+        block_semaphore: The semaphore limiting the number of blocks staged at the same time by all files.
+        file: The path to the local file.
+        file_name: The name of the blob.
+        remote_hash: The content hash of the existing blob with the same name if any.
+    """
+    async with semaphore:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Ready to copy: %s to %s.", file, file_name)
+        try:
+            content_hash = await asyncio.get_running_loop().run_in_executor(None, _content_hash, file)
+            if content_hash == remote_hash:
+                logger.info("Skipped %s, %s is up to date", file, file_name)
+                return
+
+            # the hash is stored with the blob to compare it on the next run
+            metadata = {CONTENT_HASH_METADATA: content_hash}
+
+            async def _upload():
+                # larger files are staged by _upload_blocks, one MAX_BLOCK_SIZE chunk per block in flight;
+                # smaller ones go with a single put, where the SDK awaits read() of the aiofiles handle
+                # and holds the whole file in memory
+                size = os.path.getsize(file)
+                if size > MAX_SINGLE_PUT_SIZE:
+                    await _upload_blocks(
+                        blob_container_client.get_blob_client(file_name), file, size, metadata, block_semaphore
+                    )
+                else:
+                    async with aiofiles.open(file=file, mode="rb") as data:
+                        await blob_container_client.upload_blob(
+                            name=file_name,
+                            data=data,
+                            length=size,
+                            overwrite=True,
+                            metadata=metadata,
+                        )
+
+            # the file is reopened on each attempt, since a failed attempt may consume the stream
+            await _with_retries(_upload, file_name)
+            logger.info("Uploaded %s -> %s", file, file_name)
+        except Exception as e:
+            logger.error("Exception uploading file name %s: %s", file_name, e)
+            raise
 
-        # construct blob name from file path
-        # everything rather than local_folder
-        file_subpath = os.path.relpath(file, start=local_folder)
 
-        # generate a unique name of the file
-        file_name = file_subpath.replace(os.sep, "_")
+async def _copy_blob(
+    blob_container_client: ContainerClient,
+    semaphore: asyncio.Semaphore,
+    source_client: BlobClient,
+    file_name: str,
+):
+    """
+    Copy a single blob into the container on the server side, without moving data through this machine.
 
+    Args:
+        blob_container_client: The client of the target container.
+        semaphore: The semaphore limiting the number of concurrent copies.
+        source_client: The client of the source blob, its url must contain a SAS token.
+        file_name: The name of the target blob.
+    """
+    async with semaphore:
         try:
-            logger.info(f"Ready to copy: {str(file)} to {file_name}.")
-            with open(file=str(file), mode="rb") as data:
-                blob_container_client.upload_blob(
-                    name=file_name, data=data, overwrite=True
-                )
-            logger.info("Done.")
+            target_client = blob_container_client.get_blob_client(file_name)
+            await _with_retries(
+                lambda: target_client.upload_blob_from_url(source_client.url, overwrite=True), file_name
+            )
+            # the source url contains the SAS token, so it's not logged
+            logger.info("Copied %s -> %s", source_client.blob_name, file_name)
         except Exception as e:
-            logger.info(f"Exception uploading file name {file_name}: {e}")
+            logger.error("Exception copying file name %s: %s", file_name, e)
             raise
 
+
+async def _copy_data_files(
+    blob_container_client: ContainerClient,
+    semaphore: asyncio.Semaphore,
+    source_container_url: str,
+    remote_blobs: Dict[str, BlobProperties],
+):
+    """
+    Copy all pdf blobs from the source container into the target container concurrently.
+    Blobs with the same MD5 as the existing target blobs are skipped.
+
+    Args:
+        blob_container_client: The client of the target container.
+        semaphore: The semaphore limiting the number of concurrent copies.
+        source_container_url: The url of the source container with a SAS token allowing to list and read blobs.
+        remote_blobs: The properties of the blobs in the target container by their names.
+    """
+    async with ContainerClient.from_container_url(source_container_url) as source_container_client:
+        source_clients = []
+        async for blob in source_container_client.list_blobs():
+            if not _is_pdf(blob.name):
+                continue
+            # the content isn't available locally, so MD5 calculated by the service is compared
+            source_md5 = blob.content_settings.content_md5
+            remote_blob = remote_blobs.get(blob.name.replace("/", "_"))
+            remote_md5 = remote_blob.content_settings.content_md5 if remote_blob else None
+            if source_md5 is not None and source_md5 == remote_md5:
+                logger.info("Skipped %s, it's up to date", blob.name)
+                continue
+            source_clients.append(source_container_client.get_blob_client(blob.name))
+
+        # virtual folders of the source are flattened the same way as local ones
+        await asyncio.gather(
+            *[
+                _copy_blob(blob_container_client, semaphore, source_client, source_client.blob_name.replace("/", "_"))
+                for source_client in source_clients
+            ]
+        )
+
+
+async def upload_data_files(
+    storage_account_name: str,
+    storage_container: str,
+    source_folder: str,
+):
+    """
+    Upload all pdf files from the source folder into the container concurrently.
+
+    Args:
+        storage_account_name: The name of the Azure storage account.
+        storage_container: The name of the Azure storage container.
+        source_folder: The local folder to look for pdf files in (recursively),
+            or the url of a blob container with a SAS token to copy pdf files from on the server side.
+    """
+    account_url = STORAGE_ACCOUNT_URL.format(storage_account_name=storage_account_name)
+
+    # aiohttp queues requests once the pool is exhausted, so the pool is sized
+    # to let all concurrent block uploads proceed without waiting for a connection
+    transport = AioHttpTransport(
+        session=aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONNECTION_POOL_SIZE))
+    )
+
+    # Using default Azure credentials assuming that it has all needed permissions
+    async with DefaultAzureCredential() as credential, BlobServiceClient(
+        account_url=account_url,
+        credential=credential,
+        transport=transport,
+        retry_policy=ExponentialRetry(
+            initial_backoff=RETRY_INITIAL_BACKOFF,
+            increment_base=RETRY_INCREMENT_BASE,
+            retry_total=RETRY_TOTAL,
+        ),
+    ) as blob_service_client:
+        blob_container_client = blob_service_client.get_container_client(storage_container)
+
+        # try to create the container right away rather than probing if it exists first
+        try:
+            await blob_container_client.create_container()
+            logger.info("Created %s container.", storage_container)
+        except ResourceExistsError:
+            pass
+
+        # list the container once to skip files that are already uploaded
+        remote_blobs = {
+            blob.name: blob
+            async for blob in blob_container_client.list_blobs(include=["metadata"])
+        }
+
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPLOADS)
+        block_semaphore = asyncio.Semaphore(MAX_BLOCKS_IN_FLIGHT)
+        if source_folder.startswith("https://"):
+            await _copy_data_files(blob_container_client, semaphore, source_folder, remote_blobs)
+            return
+
+        # all paths start with the root, so everything after it forms a unique name of the blob
+        root = os.path.join(os.path.abspath(source_folder), "")
+        root_len = len(root)
+        uploads = []
+        for file in _iter_pdfs(root):
+            file_name = file[root_len:].replace(os.sep, "_")
+            remote_blob = remote_blobs.get(file_name)
+            remote_hash = (remote_blob.metadata or {}).get(CONTENT_HASH_METADATA) if remote_blob else None
+            uploads.append(
+                _upload_file(blob_container_client, semaphore, block_semaphore, file, file_name, remote_hash)
+            )
+        await asyncio.gather(*uploads)
+
+
 def main():
     """
     Upload data files to Azure Blob Storage.
     This function reads the parameters from the command line, authenticates to Azure using default credentials,
-    and uploads the files from a specified local folder to a specified Azure Blob Storage container.
+    and concurrently uploads the files from a specified local folder to a specified Azure Blob Storage container.
+    If the source is a blob container url, the files are copied on the server side instead.
     """
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    # Azure SDK logs every request and response at INFO level
+    logging.getLogger("azure").setLevel(logging.WARNING)
+
     logger.info("Read and check parameters.")
     # Extract the configuration parameters from the environment variables
     parser = argparse.ArgumentParser(description="Parameter parser")
@@ -88,25 +418,26 @@ def main():
         required=True,
         help="Azure storage container name",
     )
+    parser.add_argument(
+        "--source_folder",
+        default=os.path.dirname(__file__),
+        help="local folder with pdf files or url of a blob container with a SAS token (the script folder by default)",
+    )
     args = parser.parse_args()
 
     # Validate storage account name
     if not args.storage_name.islower() or not args.storage_name.isalnum():
         raise ValueError("Storage account name must be a lowercase alphanumeric string (letters and digits).")
 
-    # Using default Azure credentials assuming that it has all needed permissions
-    logger.info("Authenticate code into Azure using default credentials.")
-    credential = DefaultAzureCredential()
-
-
     # Create the full document index
     logger.info("Uploading process has been started.")
-    upload_data_files(
-        credential=credential,
+    # uvloop handles many concurrent connections with less overhead than the default event loop
+    run = uvloop.run if uvloop is not None else asyncio.run
+    run(upload_data_files(
         storage_account_name=args.storage_name,
         storage_container=args.container_name,
-        local_folder=os.path.dirname(__file__),
-    )
+        source_folder=args.source_folder,
+    ))
     logger.info("Uploading process has been completed.")
 
 
@@ -1,8 +1,12 @@
 """Common utility functions for the search module."""
 
 import argparse
+import re
 from urllib.parse import urlparse
 
+# ASCII letters, digits, "-" and "_", with at least one letter or digit
+_VALID_NAME_RE = re.compile(r"[A-Za-z0-9_-]*[A-Za-z0-9][A-Za-z0-9_-]*")
+
 def absolute_url(value):
     """
     Validate that the input is an absolute URL with a valid scheme and netloc.
@@ -22,7 +26,8 @@ def absolute_url(value):
 
 def valid_name(value):
     """
-    Validate that the input is a valid name that may include alphanumeric symbols, "-" or "_".
+    Validate that the input is a valid name that may include ASCII alphanumeric symbols, "-" or "_".
+    The name must contain at least one letter or digit.
     The method doesn't check a specific length and case.
 
     Args:
@@ -34,7 +39,6 @@ def valid_name(value):
     """
     if not value or not value.strip():
         raise argparse.ArgumentTypeError(f"'{value}' is not a valid name")
-    parsed_value = value.replace("-", "").replace("_", "")
-    if not parsed_value.isalnum():
+    if not _VALID_NAME_RE.fullmatch(value):
         raise argparse.ArgumentTypeError(f"'{value}' contains invalid characters. Look at the documentation for naming conventions.")
     return value
@@ -5,68 +5,98 @@ This module contains functions to create or update an index, indexer, skillset,
 It serves as the primary endpoint for experiments with the AI Search service.
 """
 import argparse
+import functools
+import json
 import os
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
 from azure.identity import DefaultAzureCredential
 from azure.search.documents.indexes import SearchIndexClient, SearchIndexerClient
-from azure.search.documents.indexes.models import SearchIndex, SearchIndexerDataSourceConnection, SearchIndexer, SearchIndexerSkillset
+from azure.search.documents.indexes.models import (
+    SearchIndex,
+    SearchIndexer,
+    SearchIndexerDataContainer,
+    SearchIndexerDataSourceConnection,
+    SearchIndexerSkillset,
+)
 from .common_utils import absolute_url, valid_name
 
 logger = logging.getLogger(__name__)
 
-# Setting the threshold of logger to DEBUG
-logger.setLevel(logging.DEBUG)
-
-# Create a console handler and set its level to DEBUG
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-
-# Create a formatter and set it for the console handler
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(formatter)
-
-# Add the console handler to the logger
-logger.addHandler(console_handler)
-
 APPLICATION_JSON_CONTENT_TYPE = "application/json"
 AI_SEARCH_API_VERSION = "2024-07-01"
+CONNECTION_POOL_SIZE = 8
 INDEX_SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "index_config/documentIndex.json")
-DATASOURCE_SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "index_config/documentDataSource.json")
 SKILLSET_SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "index_config/documentSkillSet.json")
 INDEXER_SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "index_config/documentIndexer.json")
 
 
+@functools.lru_cache(maxsize=None)
+def _load_schema(file_name: str) -> dict:
+    """
+    Parse the json file once and keep the result in memory for the following calls.
+    The returned dictionary is shared between calls, so it must not be modified.
+
+    Args:
+        file_name: The path to the json file
+
+    Returns:
+        dict: The parsed content of the file
+    """
+    with open(file_name) as schema_file:
+        return json.load(schema_file)
+
+
+def _assign_values(node, pattern: re.Pattern, values_to_assign: dict):
+    """
+    Build a copy of the parsed json replacing placeholders in all string values.
+
+    Args:
+        node: The parsed json or its part
+        pattern: The compiled pattern matching all placeholders
+        values_to_assign: a dictionary with key/value pair to change in the json
+
+    Returns:
+        The copy of the node with replaced values
+    """
+    if isinstance(node, dict):
+        return {key: _assign_values(value, pattern, values_to_assign) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_assign_values(value, pattern, values_to_assign) for value in node]
+    if isinstance(node, str):
+        return pattern.sub(lambda match: values_to_assign[match.group(0)], node)
+    return node
+
+
 def _prepare_json_schema(
     file_name: str,
     values_to_assign: dict
-) -> str:
+) -> dict:
     """
-    Create a string object that represent a json with replaced values based on the dictionary.
+    Create a dictionary that represent a json with replaced values based on the dictionary.
 
     Args:
         file: The path to the json file
         values_to_assign: a dictionary with key/value pair to change in the json file
 
     Returns:
-        str: The json string with replaced values
+        dict: The parsed json with replaced values
     """
-    with open(file_name) as indexer_file:
-        indexer_def = indexer_file.read()
-
-    for key in values_to_assign.keys():
-        indexer_def = indexer_def.replace(f"{key}", values_to_assign[key])
-
-    return indexer_def
+    pattern = re.compile("|".join(re.escape(key) for key in values_to_assign))
+    return _assign_values(_load_schema(file_name), pattern, values_to_assign)
 
 
 def create_or_update_skillset(
         skillset_name: str,
         index_name: str,
         skillset_file: str,
-        ai_search_uri: str,
         open_ai_uri: str,
-        credentials: DefaultAzureCredential,
-):    
+        indexer_client: SearchIndexerClient,
+):
     """
     Create or update the skillset in the AI Search service.
 
@@ -74,22 +104,16 @@ def create_or_update_skillset(
         skillset_name: The name of the skillset to create or update.
         index_name: The name of the index to use in the skillset.
         skillset_file: The path to the skillset definition file.
-        ai_search_uri: The URI of the AI Search service.
         open_ai_uri: The base URI of the OpenAI API.
-        credentials: The Azure credentials to use for authentication.
+        indexer_client: The shared client of the AI Search service.
 
     Returns:
         None
     """
     try:
-        # Create a search indexer client
-        indexer_client = SearchIndexerClient(
-            ai_search_uri, credential=credentials, api_version=AI_SEARCH_API_VERSION
-        )
-
         # read definition from the file and replace placeholders with actual values
         definition = _prepare_json_schema(
-            skillset_file, 
+            skillset_file,
             {
                 "<search_index_name>": index_name,
                 "<skillset_name>": skillset_name,
@@ -110,8 +134,7 @@ def create_or_update_indexer(
         skillset_name: str,
         datasource_name: str,
         indexer_file: str,
-        ai_search_uri: str,
-        credential: DefaultAzureCredential,
+        indexer_client: SearchIndexerClient,
 ):
     """
     Create or update the indexer in the AI Search service.
@@ -122,18 +145,12 @@ def create_or_update_indexer(
         skillset_name: The name of the skillset to use in the indexer.
         datasource_name: The name of the data source to use in the indexer.
         indexer_file: The path to the indexer definition file.
-        ai_search_uri: The URI of the AI Search service.
-        credential: The Azure credentials to use for authentication.
+        indexer_client: The shared client of the AI Search service.
 
     Returns:
         None
     """
-    # Create a search indexer client
     try:
-        indexer_client = SearchIndexerClient(
-            ai_search_uri, credential=credential, api_version=AI_SEARCH_API_VERSION
-        )
-
         # read definition from the file and replace placeholders with actual values
         definition = _prepare_json_schema(
             indexer_file,
@@ -155,26 +172,22 @@ def create_or_update_indexer(
 
 def create_or_update_datasource(
         datasource_name: str,
-        datasource_file: str,
-        ai_search_uri: str,
         subscription_id: str,
         resource_group_name: str,
         storage_account_name: str,
         container_name: str,
-        credential: DefaultAzureCredential,
+        indexer_client: SearchIndexerClient,
 ):
     """
     Create or update the data source in the AI Search service.
 
     Args:
         datasource_name: The name of the data source to create or update.
-        datasource_file: The path to the data source definition file.
         subscription_id: The Azure subscription ID.
         resource_group_name: The name of the Azure resource group.
         storage_account_name: The name of the Azure storage account.
         container_name: The name of the Azure storage container.
-        ai_search_uri: The URI of the AI Search service.
-        credential: The Azure credentials to use for authentication.
+        indexer_client: The shared client of the AI Search service.
 
     Returns:
         None
@@ -182,32 +195,17 @@ def create_or_update_datasource(
     try:
         # Create the connection string for the storage account applying Entra ID approach
         # The connection string is in the format: "ResourceId=/subscriptions/{subscription_id}/resourceGroups/{resource_group_name}/providers/Microsoft.Storage/storageAccounts/{storage_account_name};"
-        conn_string = _get_storage_conn_string(
-            subscription_id, storage_account_name, resource_group_name)
-
-        # Create a search indexer client
-        indexer_client = SearchIndexerClient(
-            ai_search_uri, credential=credential, api_version=AI_SEARCH_API_VERSION
-        )
+        conn_string = f"ResourceId=/subscriptions/{subscription_id}/resourceGroups/{resource_group_name}" \
+            f"/providers/Microsoft.Storage/storageAccounts/{storage_account_name};"
 
-        # read definition from the file and replace placeholders with actual values
-        definition = _prepare_json_schema(
-            datasource_file,
-            {
-            "<connection_string>": conn_string,
-            "<container_name>": container_name,
-            "<data_source_name>": datasource_name,
-            }
-        )
-
-        # create an object of the data source connection and initiate data source creation process
-        data_source_connection = SearchIndexerDataSourceConnection.deserialize(
-            definition, APPLICATION_JSON_CONTENT_TYPE
-        )
-
-        # Explicitly setting the connection string as it is required by the SearchIndexerDataSourceConnection object 
+        # create an object of the data source connection; the connection string is required by the object
         # to properly establish the connection, even though credentials are provided.
-        data_source_connection.connection_string = conn_string
+        data_source_connection = SearchIndexerDataSourceConnection(
+            name=datasource_name,
+            type="azureblob",
+            connection_string=conn_string,
+            container=SearchIndexerDataContainer(name=container_name),
+        )
 
         # Create or update the data source
         indexer_client.create_or_update_data_source_connection(data_source_connection)
@@ -216,24 +214,11 @@ def create_or_update_datasource(
         raise
 
 
-def _get_storage_conn_string(
-    subscription_id: str,
-    storage_account_name: str,
-    resource_group_name: str,
-) -> str:
-    conn_string = f"ResourceId=/subscriptions/{subscription_id}" \
-        f"/resourceGroups/{resource_group_name}/providers/Microsoft.Storage" \
-        f"/storageAccounts/{storage_account_name};"
-
-    return conn_string
-
-
 def create_or_update_index(
         index_name: str,
         index_file: str,
-        ai_search_uri: str,
         open_ai_uri: str,
-        credential: DefaultAzureCredential,
+        index_client: SearchIndexClient,
 ):
     """
     Create or update the index in the AI Search service.
@@ -242,17 +227,12 @@ def create_or_update_index(
         index_name: The name of the index to create or update.
         index_file: The path to the index definition file.
         open_ai_uri: The base URI of the OpenAI API.
-        ai_search_uri: The URI of the AI Search service.
-        credential: The Azure credentials to use for authentication.
+        index_client: The shared index client of the AI Search service.
 
     Returns:
         None
     """
     try:
-        index_client = SearchIndexClient(
-            ai_search_uri, credential=credential, api_version=AI_SEARCH_API_VERSION
-        )
-
         definition = _prepare_json_schema(
             index_file,
             {
@@ -295,6 +275,13 @@ def main():
     The function uses these parameters to construct the necessary components and logs the progress 
     of each operation.
     """
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    # Azure SDK logs every request and response at INFO level
+    logging.getLogger("azure").setLevel(logging.WARNING)
+
     logger.info("Read and check parameters.")
     # Extract the configuration parameters from the environment variables
     parser = argparse.ArgumentParser(description="Parameter parser")
@@ -354,52 +341,70 @@ def main():
     skillset_name = f"{args.base_index_name}-skills"
     indexer_name = f"{args.base_index_name}-indexer"
 
-    # Create the full document index
-    logger.info("Initiate index creation method.")
-    create_or_update_index(
-        index_name,
-        INDEX_SCHEMA_PATH,
-        ai_search_uri,
-        args.openai_api_base,
-        credential,
-    )
-    logger.info("Index creation completed.")
-
-    logger.info("Initiate data source creation method.")
-    create_or_update_datasource(
-        datasource_name,
-        DATASOURCE_SCHEMA_PATH,
-        ai_search_uri,
-        args.subscription_id,
-        args.resource_group_name,
-        args.storage_name,
-        args.container_name,
-        credential,
-    )
-    logger.info("Data source creation completed.")
-
-    logger.info("Initiate skillset creation method.")
-    create_or_update_skillset(
-        skillset_name,
-        index_name,
-        SKILLSET_SCHEMA_PATH,
-        ai_search_uri,
-        args.openai_api_base,
-        credential,
+    # Share one pool of keep-alive connections between the clients to avoid a TLS handshake per operation
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=CONNECTION_POOL_SIZE))
+    transport = RequestsTransport(session=session, session_owner=False)
+
+    # Create the clients once, so all operations reuse the same credential and its cached token
+    index_client = SearchIndexClient(
+        ai_search_uri, credential=credential, api_version=AI_SEARCH_API_VERSION, transport=transport
     )
-    logger.info("Skillset creation completed.")
-
-    logger.info("Initiate indexer creation method.")
-    create_or_update_indexer(
-        indexer_name,
-        index_name,
-        skillset_name,
-        datasource_name,
-        INDEXER_SCHEMA_PATH,
-        ai_search_uri,
-        credential,
+    indexer_client = SearchIndexerClient(
+        ai_search_uri, credential=credential, api_version=AI_SEARCH_API_VERSION, transport=transport
     )
-    logger.info("Indexer creation completed.")
+
+    # Closing the clients releases their pipelines, closing the session releases the pooled connections
+    with session, index_client, indexer_client:
+        # The index and the data source don't depend on each other, so they are created in parallel.
+        # The skillset needs the index only, and the indexer needs all other entities.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            logger.info("Initiate index and data source creation methods.")
+            index_future = executor.submit(
+                create_or_update_index,
+                index_name,
+                INDEX_SCHEMA_PATH,
+                args.openai_api_base,
+                index_client,
+            )
+            datasource_future = executor.submit(
+                create_or_update_datasource,
+                datasource_name,
+                args.subscription_id,
+                args.resource_group_name,
+                args.storage_name,
+                args.container_name,
+                indexer_client,
+            )
+
+            index_future.result()
+            logger.info("Index creation completed.")
+
+            logger.info("Initiate skillset creation method.")
+            skillset_future = executor.submit(
+                create_or_update_skillset,
+                skillset_name,
+                index_name,
+                SKILLSET_SCHEMA_PATH,
+                args.openai_api_base,
+                indexer_client,
+            )
+
+            datasource_future.result()
+            logger.info("Data source creation completed.")
+            skillset_future.result()
+            logger.info("Skillset creation completed.")
+
+        logger.info("Initiate indexer creation method.")
+        create_or_update_indexer(
+            indexer_name,
+            index_name,
+            skillset_name,
+            datasource_name,
+            INDEXER_SCHEMA_PATH,
+            indexer_client,
+        )
+        logger.info("Indexer creation completed.")
 
 # This block ensures that the script runs the main function only when executed directly,
 # and not when imported as a module in another script.